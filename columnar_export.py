@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import zipfile
+import numpy as np
+import pandas as pd
+from history_store import HistoryStore
+
+TAMANO_BLOQUE_EXPORTACION = 1 << 20
+
+
+class ColumnarWriter:
+    """
+    Escribe tablas columnares en un único archivo .npz por bloques: cada bloque de cada
+    columna es un miembro 'tabla/columna/000000.npy' escrito directamente desde el buffer
+    de NumPy, de modo que la memoria usada depende del tamaño de bloque y no del total.
+    El esquema (columnas, dtypes, filas, bloques) se guarda en el miembro '__meta__'.
+    Una columna de índice consecutivo (p. ej. 'dia') no se escribe: se guarda solo su
+    inicio por bloque en el esquema y se reconstruye al leer. Un bloque puede además
+    contener n grupos consecutivos del mismo largo (p. ej. corridas): la columna de
+    grupo tampoco se escribe y el índice se reinicia en cada grupo.
+    """
+
+    def __init__(self, ruta, metadatos=None):
+        self.ruta = ruta
+        self._zip = zipfile.ZipFile(ruta, 'w', compression=zipfile.ZIP_STORED, allowZip64=True)
+        self._tablas = {}
+        self._metadatos = dict(metadatos or {})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.descartar()
+        else:
+            self.cerrar()
+
+    def escribir_bloque(self, tabla, columnas, indice=None, grupos=None):
+        """
+        Agrega un bloque de filas a la tabla. columnas: {nombre: arreglo 1D}, todas del mismo largo.
+        indice=(nombre, inicio) declara una columna implícita inicio, inicio+1, ... para el bloque.
+        grupos=(nombre, n) indica que el bloque son n grupos consecutivos del mismo largo,
+        con una columna implícita 0..n-1 por grupo (requiere indice).
+        """
+        longitudes = {len(c) for c in columnas.values()}
+        if len(longitudes) != 1:
+            raise ValueError(f"Las columnas del bloque de '{tabla}' tienen largos distintos.")
+        filas = longitudes.pop()
+
+        esquema = self._tablas.setdefault(tabla, {'columnas': {}, 'filas': 0, 'bloques': 0, 'filas_bloque': []})
+        if esquema['bloques'] and set(esquema['columnas']) != set(columnas):
+            raise ValueError(f"Las columnas del bloque no coinciden con el esquema de '{tabla}'.")
+        if esquema['bloques'] and (indice is None) != ('indice' not in esquema):
+            raise ValueError(f"El índice del bloque no coincide con el esquema de '{tabla}'.")
+        if esquema['bloques'] and (grupos is None) != ('grupo' not in esquema):
+            raise ValueError(f"Los grupos del bloque no coinciden con el esquema de '{tabla}'.")
+        if grupos is not None:
+            nombre_grupo, n_grupos = grupos
+            if indice is None or n_grupos < 1 or filas % n_grupos:
+                raise ValueError(f"El bloque de '{tabla}' no se puede dividir en {n_grupos} grupos.")
+            esquema['grupo'] = nombre_grupo
+            esquema.setdefault('grupos_bloque', []).append(int(n_grupos))
+        if indice is not None:
+            nombre_indice, inicio = indice
+            esquema['indice'] = nombre_indice
+            esquema.setdefault('inicios', []).append(int(inicio))
+
+        for nombre, valores in columnas.items():
+            valores = np.ascontiguousarray(valores)
+            esquema['columnas'].setdefault(nombre, valores.dtype.str)
+            with self._zip.open(f"{tabla}/{nombre}/{esquema['bloques']:06d}.npy", 'w', force_zip64=True) as f:
+                np.lib.format.write_array(f, valores, allow_pickle=False)
+        esquema['filas'] += filas
+        esquema['filas_bloque'].append(filas)
+        esquema['bloques'] += 1
+
+    def cerrar(self):
+        if self._zip is None:
+            return
+        meta = json.dumps({'tablas': self._tablas, 'metadatos': self._metadatos}, ensure_ascii=False)
+        with self._zip.open('__meta__.npy', 'w') as f:
+            np.lib.format.write_array(f, np.frombuffer(meta.encode('utf-8'), dtype=np.uint8))
+        self._zip.close()
+        self._zip = None
+
+    def descartar(self):
+        """
+        Cierra el archivo sin escribir el esquema y lo elimina: una exportación
+        fallida no debe dejar un .npz truncado que se lea como completo.
+        """
+        if self._zip is None:
+            return
+        self._zip.close()
+        self._zip = None
+        if os.path.exists(self.ruta):
+            os.remove(self.ruta)
+
+
+def leer_metadatos(ruta):
+    with np.load(ruta) as datos:
+        return json.loads(datos['__meta__'].tobytes().decode('utf-8'))
+
+
+def iterar_tabla(ruta, tabla):
+    """
+    Recorre una tabla exportada bloque a bloque; cada bloque es {columna: arreglo}.
+    Las columnas implícitas de grupo e índice, si existen, se reconstruyen desde el esquema.
+    """
+    esquema = leer_metadatos(ruta)['tablas'][tabla]
+    with np.load(ruta) as datos:
+        for b in range(esquema['bloques']):
+            bloque = {}
+            n_grupos = esquema['grupos_bloque'][b] if 'grupo' in esquema else 1
+            m = esquema['filas_bloque'][b] // n_grupos
+            if 'grupo' in esquema:
+                bloque[esquema['grupo']] = np.repeat(np.arange(n_grupos, dtype=np.int32), m)
+            if 'indice' in esquema:
+                inicio = esquema['inicios'][b]
+                bloque[esquema['indice']] = np.tile(np.arange(inicio, inicio + m, dtype=np.int64), n_grupos)
+            for nombre in esquema['columnas']:
+                bloque[nombre] = datos[f"{tabla}/{nombre}/{b:06d}"]
+            yield bloque
+
+
+def leer_tabla(ruta, tabla):
+    """
+    Carga una tabla completa como DataFrame (solo para tablas que caben en memoria).
+    """
+    bloques = list(iterar_tabla(ruta, tabla))
+    if not bloques:
+        return pd.DataFrame()
+    return pd.DataFrame({nombre: np.concatenate([b[nombre] for b in bloques]) for nombre in bloques[0]})
+
+
+def _codificar_historial(historial, estados):
+    # Conversión vectorizada de nombres a códigos (sin bucle por fila en Python)
+    codigos = pd.Categorical(historial, categories=estados).codes
+    if (codigos < 0).any():
+        invalido = historial[int(np.argmax(codigos < 0))]
+        raise ValueError(f"Historial con estado no válido: '{invalido}'.")
+    return codigos.astype(np.uint8 if len(estados) <= 255 else np.uint16)
+
+
+def exportar_historial(writer, historial, estados, tabla='historial', tamano_bloque=TAMANO_BLOQUE_EXPORTACION):
+    """
+    Exporta un historial (lista de estados o HistoryStore) como columnas (dia, estado)
+    y su ocupación por estado en la tabla '<tabla>_ocupacion'.
+    """
+    n = len(historial)
+    conteos = np.zeros(len(estados), dtype=np.int64)
+    for inicio in range(0, n, tamano_bloque):
+        fin = min(n, inicio + tamano_bloque)
+        if isinstance(historial, HistoryStore):
+            codigos = np.asarray(historial.codigos(inicio, fin))
+        else:
+            codigos = _codificar_historial(historial[inicio:fin], estados)
+        conteos += np.bincount(codigos, minlength=len(estados))
+        writer.escribir_bloque(tabla, {'estado': codigos}, indice=('dia', inicio))
+    if n == 0:
+        # Un bloque vacío registra el esquema para que la tabla exista aunque no haya días
+        vacio = np.empty(0, dtype=np.uint8 if len(estados) <= 255 else np.uint16)
+        writer.escribir_bloque(tabla, {'estado': vacio}, indice=('dia', 0))
+
+    writer.escribir_bloque(f"{tabla}_ocupacion", {
+        'estado': np.arange(len(estados), dtype=np.uint16),
+        'conteo': conteos,
+        'fraccion': conteos / n if n > 0 else np.zeros(len(estados)),
+    })
+
+
+def exportar_ensamble(writer, bloques, n_estados, tabla='ensamble'):
+    """
+    Exporta un ensamble de simulaciones recibido por bloques de forma (n_corridas, m_dias)
+    en formato largo (corrida, dia, estado), más la ocupación por día en '<tabla>_ocupacion'
+    (conteo de corridas en cada estado para cada día). Solo se escribe el estado de cada
+    celda: 'corrida' y 'dia' son implícitas en el esquema de cada bloque.
+    """
+    dia_inicial = 0
+    for bloque in bloques:
+        bloque = np.asarray(bloque)
+        n_corridas, m = bloque.shape
+        writer.escribir_bloque(tabla, {'estado': bloque.ravel()},
+                               indice=('dia', dia_inicial), grupos=('corrida', n_corridas))
+        ocupacion = {}
+        for e in range(n_estados):
+            ocupacion[f"estado_{e}"] = np.count_nonzero(bloque == e, axis=0).astype(np.int64)
+        writer.escribir_bloque(f"{tabla}_ocupacion", ocupacion, indice=('dia', dia_inicial))
+        dia_inicial += m
+
+
+def exportar_trayectoria_pn(writer, P_array, n_max, tabla='trayectoria_pn', tamano_bloque=4096):
+    """
+    Exporta P^n para n = 0..n_max en formato largo (n, origen, destino, probabilidad),
+    calculando las potencias de forma incremental y por bloques.
+    """
+    P = np.asarray(P_array, dtype=float)
+    k = P.shape[0]
+    origen, destino = np.divmod(np.arange(k * k, dtype=np.int64), k)
+    Pn = np.identity(k)
+    n = 0
+    while n <= n_max:
+        m = min(tamano_bloque, n_max - n + 1)
+        potencias = np.empty((m, k, k))
+        for t in range(m):
+            potencias[t] = Pn
+            Pn = Pn @ P
+        writer.escribir_bloque(tabla, {
+            'n': np.repeat(np.arange(n, n + m, dtype=np.int64), k * k),
+            'origen': np.tile(origen, m),
+            'destino': np.tile(destino, m),
+            'probabilidad': potencias.ravel(),
+        })
+        n += m
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
-from PyQt5.QtWidgets import QMainWindow, QVBoxLayout, QWidget, QLabel
+from PyQt5.QtWidgets import QMainWindow, QVBoxLayout, QWidget, QLabel, QTabWidget
 from PyQt5.QtCore import Qt
+import matplotlib
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
 import numpy as np
+from history_store import contar_estados
 
 COLOR_PALETTE = {
     "Soleado": {"fuerte": "#FFB300", "claro": "#FFE082"},
@@ -11,13 +14,59 @@ COLOR_PALETTE = {
     "Lluvioso": {"fuerte": "#1976D2", "claro": "#90CAF9"}
 }
 
+POSICIONES_CLIMA = {
+    "Soleado": (0, 1.5),
+    "Nublado": (1.2, -0.5),
+    "Lluvioso": (-1.2, -0.5)
+}
+
+# Nivel de detalle del renderizado escalable
+MAX_ETIQUETAS_NODOS = 40
+MAX_ETIQUETAS_ARISTAS = 60
+MAX_BARRAS_HISTORIAL = 15
+# Aristas por fila que se dibujan por defecto en cadenas grandes si no se indica filtro
+TOP_K_POR_DEFECTO = 5
+
+
+def seleccionar_aristas(P_array, umbral=0.0, top_k=None):
+    """
+    Devuelve (origenes, destinos, probabilidades) de las aristas con probabilidad > umbral,
+    conservando como máximo las top_k más probables de cada fila.
+    """
+    P = np.asarray(P_array, dtype=float)
+    mascara = P > umbral
+    if top_k is not None and top_k < P.shape[1]:
+        mejores = np.argpartition(-P, top_k - 1, axis=1)[:, :top_k]
+        en_top = np.zeros_like(mascara)
+        np.put_along_axis(en_top, mejores, True, axis=1)
+        mascara &= en_top
+    origenes, destinos = np.nonzero(mascara)
+    return origenes, destinos, P[origenes, destinos]
+
+
+def layout_circular(n):
+    """
+    Posiciones (n x 2) de n estados repartidos en un círculo unitario.
+    """
+    angulos = np.pi / 2 - 2 * np.pi * np.arange(n) / max(n, 1)
+    return np.column_stack([np.cos(angulos), np.sin(angulos)])
+
+
 class GraphViewer(QMainWindow):
 
-    def __init__(self, P_array, estados, historial=None):
+    def __init__(self, P_array, estados, historial=None, umbral=0.0, top_k=None, sensibilidad=None, estado_objetivo=None):
         super().__init__()
         self.P_array = P_array
         self.estados = estados
-        self.historial = historial or []
+        self.umbral = umbral
+        if top_k is None and umbral <= 0 and len(estados) > MAX_ETIQUETAS_NODOS:
+            top_k = TOP_K_POR_DEFECTO
+        self.top_k = top_k
+        # Matriz k x k de d(prob. de estado_objetivo en el día n) / dP[i, j]
+        self.sensibilidad = sensibilidad
+        self.estado_objetivo = estado_objetivo
+        # Acepta una lista de estados o un HistoryStore en disco
+        self.historial = historial if historial is not None else []
         self.setWindowTitle("Autómata Probabilístico de Clima (Gráfico)")
         self.setGeometry(100, 100, 720, 720)
         
@@ -27,22 +76,41 @@ class GraphViewer(QMainWindow):
 
         layout.addWidget(QLabel(r"<b>Autómata Probabilístico de Clima</b>", alignment=Qt.AlignCenter))
         self.figure, self.canvas = self._draw_graph(self.historial)
-        layout.addWidget(self.canvas)
 
-    def _draw_graph(self, historial=None):
-        fig = plt.figure(figsize=(6, 7))
-        gs = fig.add_gridspec(2, 1, height_ratios=[3, 1], hspace=0.35)
+        if self.sensibilidad is None:
+            layout.addWidget(NavigationToolbar(self.canvas, self))
+            layout.addWidget(self.canvas)
+        else:
+            tabs = QTabWidget()
+            tab_automata = QWidget()
+            tab_layout = QVBoxLayout(tab_automata)
+            tab_layout.addWidget(NavigationToolbar(self.canvas, self))
+            tab_layout.addWidget(self.canvas)
+            tabs.addTab(tab_automata, "Autómata")
 
-        ax = fig.add_subplot(gs[0])
-        ax.set_title("Diagrama del Autómata Probabilístico", fontsize=14)
-        ax.axis('off')
+            self.figure_sensibilidad, self.canvas_sensibilidad = self._draw_sensitivity_heatmap()
+            tab_sensibilidad = QWidget()
+            tab_layout = QVBoxLayout(tab_sensibilidad)
+            tab_layout.addWidget(NavigationToolbar(self.canvas_sensibilidad, self))
+            tab_layout.addWidget(self.canvas_sensibilidad)
+            tabs.addTab(tab_sensibilidad, "Sensibilidad de P^n")
+            layout.addWidget(tabs)
+
+    def _color_estado(self, estado, i, tono='fuerte'):
+        if estado in COLOR_PALETTE:
+            return COLOR_PALETTE[estado][tono]
+        return plt.cm.tab20(i % 20)
+
+    def _usa_layout_clima(self):
+        return (set(self.estados) <= set(POSICIONES_CLIMA)
+                and self.umbral <= 0 and self.top_k is None)
+
+    def _dibujar_automata_clima(self, ax):
+        """
+        Diagrama detallado con posiciones fijas para los tres estados del clima.
+        """
+        pos = POSICIONES_CLIMA
 
-        pos = {
-            "Soleado": (0, 1.5),
-            "Nublado": (1.2, -0.5),
-            "Lluvioso": (-1.2, -0.5)
-        }
-        
         for estado in self.estados:
             x, y = pos[estado]
             ax.plot(x, y, 'o', markersize=45, color=COLOR_PALETTE[estado]['claro'], alpha=0.95, zorder=1)
@@ -78,16 +146,94 @@ class GraphViewer(QMainWindow):
                         text_y = mid_y + (x1 - x2) * rad * 3 * text_offset
                         ax.text(text_x, text_y, f"{prob:.4f}", color=COLOR_PALETTE[estado_origen]['fuerte'], fontsize=9, ha='center', va='center', zorder=3, backgroundcolor='white', alpha=0.9)
 
+    def _dibujar_automata_escalable(self, ax):
+        """
+        Diagrama para cualquier número de estados: layout circular automático,
+        aristas filtradas (umbral / top-k por fila) y dibujadas en lote con una sola
+        llamada a quiver, y etiquetas según el nivel de detalle.
+        """
+        n = len(self.estados)
+        pos = layout_circular(n)
+        colores = [self._color_estado(e, i) for i, e in enumerate(self.estados)]
+        tamano_nodo = float(np.clip(4000 / max(n, 1), 12, 900))
+        ax.scatter(pos[:, 0], pos[:, 1], s=tamano_nodo, c=[self._color_estado(e, i, 'claro') for i, e in enumerate(self.estados)],
+                   edgecolors=colores, linewidths=0.8, zorder=2)
+
+        origenes, destinos, probs = seleccionar_aristas(self.P_array, self.umbral, self.top_k)
+        colores_rgba = np.array([matplotlib.colors.to_rgba(c) for c in colores])
+
+        bucles = origenes == destinos
+        if bucles.any():
+            # Los bucles se dibujan como anillos hacia afuera del nodo, en un solo scatter
+            anillos = pos[origenes[bucles]] * 1.07
+            ax.scatter(anillos[:, 0], anillos[:, 1], s=tamano_nodo * 0.5 * (0.3 + probs[bucles]),
+                       facecolors='none', edgecolors=colores_rgba[origenes[bucles]], linewidths=1.0, zorder=1)
+
+        o, d, p = origenes[~bucles], destinos[~bucles], probs[~bucles]
+        if len(o):
+            inicio, fin = pos[o], pos[d]
+            direccion = fin - inicio
+            longitud = np.linalg.norm(direccion, axis=1, keepdims=True)
+            unitario = direccion / longitud
+            # Desplazamiento perpendicular para separar i->j de j->i; recorte por el radio del nodo
+            perpendicular = np.column_stack([unitario[:, 1], -unitario[:, 0]]) * 0.015
+            radio = min(0.1, 1.5 / max(n, 1))
+            inicio = inicio + unitario * radio + perpendicular
+            fin = fin - unitario * radio + perpendicular
+            colores_aristas = colores_rgba[o].copy()
+            colores_aristas[:, 3] = 0.25 + 0.75 * p
+            ax.quiver(inicio[:, 0], inicio[:, 1], (fin - inicio)[:, 0], (fin - inicio)[:, 1],
+                      angles='xy', scale_units='xy', scale=1, color=colores_aristas,
+                      width=0.002 if n > MAX_ETIQUETAS_NODOS else 0.004, headwidth=4, headlength=5, zorder=0)
+
+        if n <= MAX_ETIQUETAS_NODOS:
+            for i, estado in enumerate(self.estados):
+                x, y = pos[i] * 1.2
+                ax.text(x, y, estado, ha='center', va='center', fontsize=max(6, 11 - n // 6),
+                        weight='bold', color=colores[i], zorder=3)
+
+        if len(probs) <= MAX_ETIQUETAS_ARISTAS:
+            for i, j, prob in zip(origenes, destinos, probs):
+                if i == j:
+                    x, y = pos[i] * 0.84
+                else:
+                    x, y = pos[i] + (pos[j] - pos[i]) * 0.6
+                ax.text(x, y, f"{prob:.4f}", color=colores[i], fontsize=8, ha='center', va='center',
+                        zorder=3, backgroundcolor='white', alpha=0.9)
+
+        ax.set_xlim(-1.3, 1.3)
+        ax.set_ylim(-1.3, 1.3)
+        ax.set_aspect('equal')
+        if len(probs) > MAX_ETIQUETAS_ARISTAS or n > MAX_ETIQUETAS_NODOS:
+            ax.set_title(f"Diagrama del Autómata Probabilístico ({n} estados, {len(probs)} aristas)", fontsize=12)
+
+    def _draw_graph(self, historial=None):
+        fig = plt.figure(figsize=(6, 7))
+        gs = fig.add_gridspec(2, 1, height_ratios=[3, 1], hspace=0.35)
+
+        ax = fig.add_subplot(gs[0])
+        ax.set_title("Diagrama del Autómata Probabilístico", fontsize=14)
+        ax.axis('off')
+
+        if self._usa_layout_clima():
+            self._dibujar_automata_clima(ax)
+        else:
+            self._dibujar_automata_escalable(ax)
+
         ax_hist = fig.add_subplot(gs[1])
         ax_hist.set_title("Resumen del Historial (conteo por estado)", fontsize=11)
         ax_hist.set_axis_off()
 
-        if historial:
-            counts = {estado: historial.count(estado) for estado in self.estados}
+        if historial is not None and len(historial) > 0:
+            counts = contar_estados(historial, self.estados)
             total = sum(counts.values()) if sum(counts.values()) > 0 else 1
-            estados_plot = self.estados
+            # Con muchos estados solo se muestran los más frecuentes
+            indices = sorted(range(len(self.estados)), key=lambda i: -counts[self.estados[i]])[:MAX_BARRAS_HISTORIAL]
+            if len(self.estados) <= MAX_BARRAS_HISTORIAL:
+                indices = range(len(self.estados))
+            estados_plot = [self.estados[i] for i in indices]
             valores = [counts[e] for e in estados_plot]
-            colores = [COLOR_PALETTE[e]['fuerte'] for e in estados_plot]
+            colores = [self._color_estado(self.estados[i], i) for i in indices]
 
             left, bottom, width, height = 0.12, 0.08, 0.76, 0.28
             axb = fig.add_axes([left, 0.08, width, 0.18])
@@ -105,3 +251,33 @@ class GraphViewer(QMainWindow):
         fig.tight_layout()
         canvas = FigureCanvas(fig)
         return fig, canvas
+
+    def _draw_sensitivity_heatmap(self):
+        fig = plt.figure(figsize=(6, 6))
+        ax = fig.add_subplot(111)
+        S = np.asarray(self.sensibilidad, dtype=float)
+        limite = max(float(np.abs(S).max()), 1e-12)
+        im = ax.imshow(S, cmap='RdBu_r', vmin=-limite, vmax=limite)
+        fig.colorbar(im, ax=ax, fraction=0.046, pad=0.04)
+
+        titulo = "Sensibilidad del pronóstico a cada entrada de P"
+        if self.estado_objetivo:
+            titulo += f"\n(prob. de {self.estado_objetivo} en el día n)"
+        ax.set_title(titulo, fontsize=12)
+        ax.set_xlabel("Estado destino (j)")
+        ax.set_ylabel("Estado origen (i)")
+
+        if len(self.estados) <= MAX_ETIQUETAS_NODOS:
+            ax.set_xticks(np.arange(len(self.estados)))
+            ax.set_yticks(np.arange(len(self.estados)))
+            ax.set_xticklabels(self.estados, rotation=45 if len(self.estados) > 3 else 0)
+            ax.set_yticklabels(self.estados)
+        if S.size <= 100:
+            for i in range(S.shape[0]):
+                for j in range(S.shape[1]):
+                    ax.text(j, i, f"{S[i, j]:+.4f}", ha='center', va='center', fontsize=9,
+                            color='white' if abs(S[i, j]) > 0.6 * limite else 'black')
+
+        fig.tight_layout()
+        canvas = FigureCanvas(fig)
+        return fig, canvas
@@ -4,10 +4,12 @@ from PyQt5.QtWidgets import (
     QLabel, QComboBox, QPushButton,
     QTableWidget, QHeaderView, QGroupBox,
     QMessageBox, QSpinBox, QProgressBar, QApplication, QTableWidgetItem, QFrame,
-    QScrollArea # <--- Importante para el scroll vertical
+    QScrollArea, # <--- Importante para el scroll vertical
+    QCheckBox
 )
 from PyQt5.QtCore import Qt, QLocale, QTimer
 from PyQt5.QtGui import QFont, QColor, QPalette, QBrush, QLinearGradient
+from history_store import contar_estados
 
 class MarkovGUI(QMainWindow):
 
@@ -239,6 +241,18 @@ class MarkovGUI(QMainWindow):
         n_dias_layout.addWidget(self.spin_n_dias)
         param_layout.addLayout(n_dias_layout)
 
+        semilla_layout = QHBoxLayout()
+        semilla_layout.addWidget(QLabel("<b>Semilla de Simulación:</b>"))
+        self.spin_semilla = QSpinBox()
+        self.spin_semilla.setRange(0, 999999)
+        self.spin_semilla.setSpecialValueText("Aleatoria")
+        self.spin_semilla.setValue(0)
+        semilla_layout.addWidget(self.spin_semilla)
+        param_layout.addLayout(semilla_layout)
+
+        self.check_vista_previa = QCheckBox("Vista previa en vivo (recalcula P^n al editar la matriz)")
+        param_layout.addWidget(self.check_vista_previa)
+
         self.main_layout.addWidget(param_group)
 
     def _setup_matriz_transicion_box(self):
@@ -273,8 +287,11 @@ class MarkovGUI(QMainWindow):
         self.btn_calcular.setStyleSheet("background-color: #43A047;")
         self.btn_reiniciar = QPushButton("🔄 Reiniciar Valores")
         self.btn_reiniciar.setStyleSheet("background-color: #E53935;")
+        self.btn_exportar = QPushButton("💾 Exportar Resultados")
+        self.btn_exportar.setStyleSheet("background-color: #1976D2;")
         action_layout.addWidget(self.btn_calcular)
         action_layout.addWidget(self.btn_reiniciar)
+        action_layout.addWidget(self.btn_exportar)
         self.main_layout.addLayout(action_layout)
 
     def _setup_resultados_box(self):
@@ -404,7 +421,7 @@ class MarkovGUI(QMainWindow):
     def update_statistics_and_history(self, historial_completo):
         # El historial_completo ahora tiene N días, lo que corrige el cálculo de porcentajes.
         total_dias = len(historial_completo)
-        counts = {estado: historial_completo.count(estado) for estado in self.estados}
+        counts = contar_estados(historial_completo, self.estados)
 
         for estado in self.estados:
             count = counts.get(estado, 0)
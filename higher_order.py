@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+TAMANO_BLOQUE_AJUSTE = 1 << 20
+
+
+def _fusionar_conteos(claves_a, conteos_a, claves_b, conteos_b):
+    claves, inverso = np.unique(np.concatenate([claves_a, claves_b]), return_inverse=True)
+    return claves, np.bincount(inverso, weights=np.concatenate([conteos_a, conteos_b]))
+
+
+class HigherOrderChain:
+    """
+    Cadena de Markov de orden k sobre un índice compacto de contextos.
+    Cada contexto (s_{t-j+1}, ..., s_t) se codifica como un entero en base K
+    (c = sum s_{t-i} · K^i), de modo que avanzar un día es c' = (c · K) mod K^j + s.
+    Para cada orden j = 1..k solo se guardan los contextos observados, en formato
+    disperso (CSR): contextos ordenados -> (siguientes estados, probabilidades).
+    Un contexto no observado retrocede a su sufijo observado más largo (backoff); los
+    contextos de orden 1 sin observaciones usan la fila de P_respaldo del último estado.
+    Así la memoria y el costo por paso dependen de los contextos observados y no de K^k.
+    """
+
+    def __init__(self, orden, n_estados, tablas, P_respaldo):
+        self.orden = orden
+        self.K = n_estados
+        self.modulo = n_estados ** orden
+        # tablas[j] = (contextos, indptr, siguientes, probabilidades) de orden j (tablas[0] no se usa)
+        self.tablas = tablas
+        self.P_respaldo = np.asarray(P_respaldo, dtype=float)
+
+    @classmethod
+    def ajustar(cls, codigos, orden, n_estados, P_respaldo, tamano_bloque=TAMANO_BLOQUE_AJUSTE):
+        """
+        Estima las tablas de transición de orden 1..k contando las secuencias observadas
+        en un historial de códigos de estado (0..K-1). codigos puede ser cualquier secuencia
+        que admita rebanadas (p. ej. la vista mapeada de un HistoryStore): se recorre por
+        bloques solapados en k días y se fusionan los conteos, así que la memoria depende
+        del tamaño de bloque y de los contextos observados, no del largo del historial.
+        """
+        if orden < 1:
+            raise ValueError("El orden de la cadena debe ser al menos 1.")
+        if n_estados ** (orden + 1) >= 2 ** 63:
+            raise ValueError(f"El orden {orden} es demasiado grande para {n_estados} estados.")
+        N = len(codigos)
+        if N <= orden:
+            raise ValueError(f"El historial debe tener más de {orden} días para ajustar una cadena de orden {orden}.")
+
+        K = n_estados
+        P_respaldo = np.asarray(P_respaldo, dtype=float)
+        # acumulados[j] = (claves contexto·K + siguiente, conteos) de orden j
+        acumulados = [(np.empty(0, dtype=np.int64), np.empty(0)) for _ in range(orden + 1)]
+        for a in range(0, N - 1, tamano_bloque):
+            # Pares cuyo contexto empieza en [a, a + tamano_bloque); el tramo incluye los k días siguientes
+            tramo = np.asarray(codigos[a:min(N, a + tamano_bloque + orden)], dtype=np.int64)
+            for j in range(1, orden + 1):
+                n_pares = min(tamano_bloque, len(tramo) - j)
+                if n_pares <= 0:
+                    continue
+                # Codificación vectorizada del contexto de largo j
+                contexto = np.zeros(n_pares, dtype=np.int64)
+                for i in range(j):
+                    contexto = contexto * K + tramo[i:i + n_pares]
+                claves, conteos = np.unique(contexto * K + tramo[j:j + n_pares], return_counts=True)
+                acumulados[j] = _fusionar_conteos(*acumulados[j], claves, conteos)
+
+        tablas = [None]
+        for j in range(1, orden + 1):
+            claves, conteos = acumulados[j]
+
+            if j == 1:
+                # Orden 1 completo: los estados sin observaciones usan P_respaldo
+                faltantes = np.setdiff1d(np.arange(K), claves // K)
+                if len(faltantes):
+                    claves_respaldo = (faltantes[:, None] * K + np.arange(K)).ravel()
+                    pesos_respaldo = P_respaldo[faltantes].ravel()
+                    positivos = pesos_respaldo > 0
+                    claves = np.concatenate([claves, claves_respaldo[positivos]])
+                    conteos = np.concatenate([conteos, pesos_respaldo[positivos]])
+                    orden_claves = np.argsort(claves)
+                    claves, conteos = claves[orden_claves], conteos[orden_claves]
+
+            contexto_clave, siguientes = np.divmod(claves, K)
+            contextos, inicio_fila = np.unique(contexto_clave, return_index=True)
+            indptr = np.append(inicio_fila, len(claves)).astype(np.int64)
+            totales = np.add.reduceat(conteos, inicio_fila)
+            probabilidades = conteos / np.repeat(totales, np.diff(indptr))
+            tablas.append((contextos, indptr, siguientes, probabilidades))
+        return cls(orden, K, tablas, P_respaldo)
+
+    @property
+    def contextos_observados(self):
+        return sum(len(self.tablas[j][0]) for j in range(1, self.orden + 1))
+
+    def codificar(self, ultimos_estados):
+        """
+        Codifica los últimos k códigos de estado (del más antiguo al más reciente).
+        """
+        if len(ultimos_estados) != self.orden:
+            raise ValueError(f"Se necesitan los últimos {self.orden} estados para el contexto.")
+        c = 0
+        for s in ultimos_estados:
+            c = c * self.K + int(s)
+        return c
+
+    def _resolver(self, codigos, largo):
+        """
+        Para contextos de largo 'largo', devuelve (orden, fila) de su sufijo observado más largo.
+        """
+        ordenes = np.zeros(len(codigos), dtype=np.int64)
+        filas = np.zeros(len(codigos), dtype=np.int64)
+        pendientes = np.arange(len(codigos))
+        for j in range(largo, 0, -1):
+            contextos = self.tablas[j][0]
+            sufijos = codigos[pendientes] % (self.K ** j)
+            idx = np.minimum(np.searchsorted(contextos, sufijos), len(contextos) - 1)
+            encontrados = contextos[idx] == sufijos
+            ordenes[pendientes[encontrados]] = j
+            filas[pendientes[encontrados]] = idx[encontrados]
+            pendientes = pendientes[~encontrados]
+            if not len(pendientes):
+                break
+        return ordenes, filas
+
+    def fila(self, contexto):
+        """
+        Devuelve (siguientes, probabilidades) del sufijo observado más largo del contexto.
+        """
+        ordenes, filas = self._resolver(np.array([contexto], dtype=np.int64), self.orden)
+        _, indptr, siguientes, probabilidades = self.tablas[ordenes[0]]
+        a, b = indptr[filas[0]], indptr[filas[0] + 1]
+        return siguientes[a:b], probabilidades[a:b]
+
+    def simular(self, contexto, n_dias, rng):
+        """
+        Simula n_dias a partir de un contexto codificado; devuelve los códigos de estado de cada día
+        (el primero es el último estado del contexto).
+        """
+        resultado = np.empty(n_dias, dtype=np.int64)
+        u = rng.random(n_dias)
+        for t in range(n_dias):
+            resultado[t] = contexto % self.K
+            siguientes, probs = self.fila(contexto)
+            acumuladas = np.cumsum(probs)
+            j = min(int(np.searchsorted(acumuladas, u[t] * acumuladas[-1], side='right')), len(siguientes) - 1)
+            contexto = (contexto * self.K) % self.modulo + int(siguientes[j])
+        return resultado
+
+    def propagar(self, contexto, n):
+        """
+        Distribución del estado tras n pasos desde un contexto codificado. Se propaga una
+        distribución dispersa sobre nodos (orden, contexto observado): el sucesor de un
+        nodo de orden j es su contexto extendido (largo j+1, como máximo k) resuelto a su
+        sufijo observado más largo, que es exactamente la fila que usaría simular.
+        Los nodos vivos nunca superan los contextos observados de todos los órdenes.
+        """
+        ordenes, filas = self._resolver(np.array([contexto], dtype=np.int64), self.orden)
+        masas = np.array([1.0])
+        for _ in range(n):
+            nuevos_ordenes, nuevas_filas, nuevas_masas = [], [], []
+            for j in np.unique(ordenes):
+                contextos, indptr, siguientes, probabilidades = self.tablas[j]
+                grupo = ordenes == j
+                filas_j = filas[grupo]
+                # Expansión CSR por lotes de todas las filas del grupo
+                largos = indptr[filas_j + 1] - indptr[filas_j]
+                posiciones = np.repeat(indptr[filas_j] - np.cumsum(largos) + largos, largos) + np.arange(largos.sum())
+                largo = min(j + 1, self.orden)
+                sucesores = (np.repeat(contextos[filas_j], largos) * self.K + siguientes[posiciones]) % (self.K ** largo)
+                o, f = self._resolver(sucesores, largo)
+                nuevos_ordenes.append(o)
+                nuevas_filas.append(f)
+                nuevas_masas.append(np.repeat(masas[grupo], largos) * probabilidades[posiciones])
+
+            claves, inverso = np.unique(
+                np.concatenate(nuevas_filas) * (self.orden + 1) + np.concatenate(nuevos_ordenes),
+                return_inverse=True,
+            )
+            masas = np.bincount(inverso, weights=np.concatenate(nuevas_masas))
+            filas, ordenes = np.divmod(claves, self.orden + 1)
+
+        ultimos = np.empty(len(filas), dtype=np.int64)
+        for j in np.unique(ordenes):
+            grupo = ordenes == j
+            ultimos[grupo] = self.tablas[j][0][filas[grupo]] % self.K
+        return np.bincount(ultimos, weights=masas, minlength=self.K)
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+import os
+from collections import Counter
+import numpy as np
+
+
+def contar_estados(historial, estados):
+    """
+    Devuelve {estado: conteo} para una lista de estados o un HistoryStore.
+    """
+    if isinstance(historial, HistoryStore):
+        return historial.conteo_estados()
+    conteo = Counter(historial)
+    return {estado: conteo.get(estado, 0) for estado in estados}
+
+
+class HistoryStore:
+    """
+    Historial climático en disco: guarda un código compacto por día en un archivo
+    mapeado en memoria y mantiene, por bloque, prefijos acumulados de conteos de
+    estados y de transiciones para responder estadísticas de cualquier rango de días
+    sin recorrer el historial completo.
+    La cantidad real de días se guarda en '<ruta>.len' después de cada escritura, de modo
+    que la capacidad reservada en el archivo nunca se confunde con días simulados.
+    """
+
+    TAMANO_BLOQUE = 65536
+    CAPACIDAD_INICIAL = 1 << 20
+
+    def __init__(self, ruta, estados, capacidad_inicial=CAPACIDAD_INICIAL):
+        self._inicializar(ruta, estados)
+        open(ruta, 'wb').close()
+        self._guardar_longitud()
+        self._redimensionar(max(int(capacidad_inicial), self.TAMANO_BLOQUE))
+
+    @classmethod
+    def abrir(cls, ruta, estados):
+        """
+        Abre un historial existente en solo lectura y reconstruye el índice recorriéndolo
+        por bloques. El archivo solo se amplía al agregar nuevos días.
+        """
+        store = cls.__new__(cls)
+        store._inicializar(ruta, estados)
+        tamano = os.path.getsize(ruta) // np.dtype(store.dtype).itemsize
+        if os.path.exists(store._ruta_longitud):
+            with open(store._ruta_longitud) as f:
+                n = min(int(f.read().strip() or 0), tamano)
+        else:
+            # Archivo recortado por cerrar() sin archivo de longitud
+            n = tamano
+        store._longitud = n
+        store._mapear_lectura()
+        store._indexar(0, n)
+        return store
+
+    def _inicializar(self, ruta, estados):
+        self.ruta = ruta
+        self._ruta_longitud = ruta + '.len'
+        self.estados = list(estados)
+        self.k = len(self.estados)
+        self.dtype = np.uint8 if self.k <= 255 else np.uint16
+        self._longitud = 0
+        self._capacidad = 0
+        self._mm = None
+        # prefijo[b] = conteos de los días [0, b * TAMANO_BLOQUE)
+        self._prefijo_estados = [np.zeros(self.k, dtype=np.int64)]
+        # prefijo[b] = transiciones cuyo día destino es < b * TAMANO_BLOQUE
+        self._prefijo_transiciones = [np.zeros((self.k, self.k), dtype=np.int64)]
+        self._acum_estados = np.zeros(self.k, dtype=np.int64)
+        self._acum_transiciones = np.zeros((self.k, self.k), dtype=np.int64)
+
+    def _mapear_lectura(self):
+        # Mapa de solo lectura de exactamente _longitud días (np.memmap no admite largo 0)
+        if self._longitud > 0:
+            self._mm = np.memmap(self.ruta, dtype=self.dtype, mode='r', shape=(self._longitud,))
+        else:
+            self._mm = np.empty(0, dtype=self.dtype)
+        self._capacidad = self._longitud
+
+    def _guardar_longitud(self):
+        with open(self._ruta_longitud, 'w') as f:
+            f.write(str(self._longitud))
+
+    # ---------------- Escritura ----------------
+    def _redimensionar(self, capacidad):
+        if isinstance(self._mm, np.memmap) and self._mm.mode != 'r':
+            self._mm.flush()
+        self._mm = None
+        with open(self.ruta, 'r+b') as f:
+            f.truncate(capacidad * np.dtype(self.dtype).itemsize)
+        self._mm = np.memmap(self.ruta, dtype=self.dtype, mode='r+', shape=(capacidad,))
+        self._capacidad = capacidad
+
+    def agregar(self, estados):
+        """
+        Agrega una secuencia de estados (nombres) al final del historial.
+        """
+        codigos = np.fromiter((self.estados.index(e) for e in estados), dtype=self.dtype)
+        self.agregar_codigos(codigos)
+
+    def agregar_codigos(self, codigos):
+        """
+        Agrega un arreglo de códigos de estado (0..k-1) y actualiza el índice por bloques.
+        """
+        codigos = np.asarray(codigos)
+        if codigos.size == 0:
+            return
+        if codigos.min() < 0 or codigos.max() >= self.k:
+            raise ValueError("Código de estado fuera de rango.")
+        codigos = codigos.astype(self.dtype, copy=False)
+
+        fin_total = self._longitud + len(codigos)
+        if fin_total > self._capacidad:
+            self._redimensionar(max(fin_total, 2 * self._capacidad))
+
+        self._mm[self._longitud:fin_total] = codigos
+        self._indexar(self._longitud, fin_total)
+        self._longitud = fin_total
+        # Los datos se vacían antes de publicar la nueva longitud
+        self.flush()
+
+    def _indexar(self, inicio, fin_total):
+        B = self.TAMANO_BLOQUE
+        while inicio < fin_total:
+            fin = min(fin_total, (inicio // B + 1) * B)
+            self._acum_estados += np.bincount(self._mm[inicio:fin], minlength=self.k)
+            desde = max(inicio, 1)
+            if desde < fin:
+                self._acum_transiciones += self._contar_pares(self._mm[desde - 1:fin])
+            if fin % B == 0:
+                self._prefijo_estados.append(self._acum_estados.copy())
+                self._prefijo_transiciones.append(self._acum_transiciones.copy())
+            inicio = fin
+
+    def _contar_pares(self, codigos):
+        return np.bincount(
+            codigos[:-1].astype(np.int64) * self.k + codigos[1:], minlength=self.k * self.k
+        ).reshape(self.k, self.k)
+
+    def flush(self):
+        if isinstance(self._mm, np.memmap) and self._mm.mode != 'r':
+            self._mm.flush()
+        self._guardar_longitud()
+
+    def cerrar(self):
+        """
+        Vacía el mapa a disco, recorta el archivo a la longitud real del historial
+        y lo vuelve a mapear en solo lectura (el store sigue siendo consultable).
+        """
+        self.flush()
+        self._mm = None
+        with open(self.ruta, 'r+b') as f:
+            f.truncate(self._longitud * np.dtype(self.dtype).itemsize)
+        self._mapear_lectura()
+
+    # ---------------- Lectura ----------------
+    def __len__(self):
+        return self._longitud
+
+    def __getitem__(self, clave):
+        if isinstance(clave, slice):
+            # El mapa puede ser más largo que el historial (capacidad reservada)
+            return [self.estados[c] for c in self._mm[:self._longitud][clave]]
+        if clave < 0:
+            clave += self._longitud
+        if not 0 <= clave < self._longitud:
+            raise IndexError("Día fuera del historial.")
+        return self.estados[self._mm[clave]]
+
+    def codigos(self, inicio=0, fin=None):
+        """
+        Vista (sin copia) de los códigos de estado de los días [inicio, fin).
+        """
+        inicio, fin = self._normalizar_rango(inicio, fin)
+        return self._mm[inicio:fin]
+
+    def _normalizar_rango(self, inicio, fin):
+        fin = self._longitud if fin is None else fin
+        if not 0 <= inicio <= fin <= self._longitud:
+            raise ValueError(f"Rango de días inválido: [{inicio}, {fin}).")
+        return inicio, fin
+
+    def _prefijo_conteo_estados(self, x):
+        b = x // self.TAMANO_BLOQUE
+        base = self._prefijo_estados[b]
+        resto = self._mm[b * self.TAMANO_BLOQUE:x]
+        return base + np.bincount(resto, minlength=self.k)
+
+    def _prefijo_conteo_transiciones(self, x):
+        b = x // self.TAMANO_BLOQUE
+        base = self._prefijo_transiciones[b]
+        desde = max(b * self.TAMANO_BLOQUE, 1)
+        if desde >= x:
+            return base
+        return base + self._contar_pares(self._mm[desde - 1:x])
+
+    def conteo_estados(self, inicio=0, fin=None):
+        """
+        Devuelve {estado: conteo} de los días [inicio, fin).
+        """
+        inicio, fin = self._normalizar_rango(inicio, fin)
+        conteos = self._prefijo_conteo_estados(fin) - self._prefijo_conteo_estados(inicio)
+        return {estado: int(c) for estado, c in zip(self.estados, conteos)}
+
+    def conteo_transiciones(self, inicio=0, fin=None):
+        """
+        Devuelve la matriz k x k de transiciones observadas entre días consecutivos de [inicio, fin).
+        """
+        inicio, fin = self._normalizar_rango(inicio, fin)
+        if fin - inicio < 2:
+            return np.zeros((self.k, self.k), dtype=np.int64)
+        return self._prefijo_conteo_transiciones(fin) - self._prefijo_conteo_transiciones(inicio + 1)
+
+    def ocupacion(self, inicio=0, fin=None):
+        """
+        Devuelve {estado: fracción de días} en [inicio, fin).
+        """
+        conteos = self.conteo_estados(inicio, fin)
+        total = sum(conteos.values())
+        return {estado: (c / total if total > 0 else 0.0) for estado, c in conteos.items()}
+
+    def matriz_transicion_empirica(self, inicio=0, fin=None):
+        """
+        Estima P a partir de las transiciones observadas en [inicio, fin).
+        Las filas sin observaciones quedan en cero.
+        """
+        conteos = self.conteo_transiciones(inicio, fin).astype(float)
+        sumas = conteos.sum(axis=1, keepdims=True)
+        return np.divide(conteos, sumas, out=np.zeros_like(conteos), where=sumas > 0)
@@ -2,6 +2,8 @@
 import numpy as np
 import pandas as pd
 import random
+from seasonal_index import SeasonalProductIndex
+from higher_order import HigherOrderChain
 
 class MarkovModel:
     
@@ -16,6 +18,10 @@ class MarkovModel:
             ])
         else:
             self.P_array = P_initial
+        # Calendario opcional de matrices por día (cadena no homogénea)
+        self.calendario = None
+        # Cadena opcional de orden k ajustada a un historial
+        self.cadena_orden_superior = None
 
     def validar_matriz(self, P_df):
         """
@@ -36,15 +42,16 @@ class MarkovModel:
             
         return True, P_array
 
-    def calcular_pn(self, n):
+    def calcular_pn(self, n, P_array=None):
         """
         Calcula P^n (potencia de la matriz de transición).
+        Usa P_array si se indica; si no, la matriz del modelo.
         Si n < 1 devuelve la identidad.
         """
         if n < 1:
             return np.identity(len(self.ESTADOS))
         
-        return np.linalg.matrix_power(self.P_array, n)
+        return np.linalg.matrix_power(self.P_array if P_array is None else P_array, n)
 
     def obtener_probabilidades_finales(self, Pn_o_P_array, estado_inicial_str):
         """
@@ -61,14 +68,16 @@ class MarkovModel:
             'Probabilidad': probabilidades
         })
 
-    def simular_historial_climatico(self, P_array_actual, n_dias_simulacion, estado_inicial_str):
+    def simular_historial_climatico(self, P_array_actual, n_dias_simulacion, estado_inicial_str, semilla=None):
         """
         Simula n_dias_simulacion a partir de estado_inicial_str usando P_array_actual.
+        Si se indica semilla, la simulación es reproducible.
         Devuelve lista de estados (historial).
         """
         if n_dias_simulacion < 1:
             return []
 
+        generador = random.Random(semilla) if semilla is not None else random
         historial = []
         try:
             estado_actual_idx = self.ESTADOS.index(estado_inicial_str)
@@ -82,19 +91,248 @@ class MarkovModel:
             if not np.isclose(np.sum(transicion_probs), 1.0):
                 transicion_probs = transicion_probs / np.sum(transicion_probs)
 
-            estado_actual_idx = random.choices(range(len(self.ESTADOS)), weights=transicion_probs, k=1)[0]
+            estado_actual_idx = generador.choices(range(len(self.ESTADOS)), weights=transicion_probs, k=1)[0]
             
         return historial
 
-    def obtener_clima_mas_probable_dia_n(self, n_dias, estado_inicial_str):
+    def simular_historial_en_store(self, P_array_actual, n_dias_simulacion, estado_inicial_str, store, semilla=None, tamano_bloque=65536):
+        """
+        Simula n_dias_simulacion escribiendo los códigos de estado en un HistoryStore
+        por bloques, de modo que la memoria usada no depende de n_dias_simulacion.
+        Si se indica semilla, la simulación es reproducible.
+        Devuelve el store.
+        """
+        try:
+            estado_actual_idx = self.ESTADOS.index(estado_inicial_str)
+        except ValueError:
+            raise ValueError(f"Estado inicial '{estado_inicial_str}' no es válido para simulación.")
+
+        P = np.asarray(P_array_actual, dtype=float)
+        acumuladas = np.cumsum(P / P.sum(axis=1, keepdims=True), axis=1)
+        acumuladas[:, -1] = 1.0
+        rng = np.random.default_rng(semilla)
+        restantes = n_dias_simulacion
+        while restantes > 0:
+            m = min(restantes, tamano_bloque)
+            u = rng.random(m)
+            bloque = np.empty(m, dtype=np.int64)
+            for t in range(m):
+                bloque[t] = estado_actual_idx
+                estado_actual_idx = int(np.searchsorted(acumuladas[estado_actual_idx], u[t], side='right'))
+            store.agregar_codigos(bloque)
+            restantes -= m
+        return store
+
+    def simular_ensamble(self, P_array_actual, n_corridas, n_dias_simulacion, estado_inicial_str, semilla=None, celdas_por_bloque=1 << 20):
+        """
+        Simula n_corridas historiales independientes de n_dias_simulacion, vectorizando
+        cada paso sobre todas las corridas. Entrega bloques de códigos de forma
+        (n_corridas, m_dias) para poder procesar o exportar ensambles grandes con memoria acotada.
+        """
+        try:
+            estado_idx = self.ESTADOS.index(estado_inicial_str)
+        except ValueError:
+            raise ValueError(f"Estado inicial '{estado_inicial_str}' no es válido para simulación.")
+
+        P = np.asarray(P_array_actual, dtype=float)
+        acumuladas = np.cumsum(P / P.sum(axis=1, keepdims=True), axis=1)
+        acumuladas[:, -1] = 1.0
+        rng = np.random.default_rng(semilla)
+        estados_actuales = np.full(n_corridas, estado_idx, dtype=np.uint8)
+        m_max = max(1, celdas_por_bloque // max(n_corridas, 1))
+
+        restantes = n_dias_simulacion
+        while restantes > 0:
+            m = min(restantes, m_max)
+            bloque = np.empty((n_corridas, m), dtype=np.uint8)
+            for t in range(m):
+                bloque[:, t] = estados_actuales
+                u = rng.random(n_corridas)
+                estados_actuales = (u[:, None] >= acumuladas[estados_actuales]).sum(axis=1).astype(np.uint8)
+            yield bloque
+            restantes -= m
+
+    def obtener_clima_mas_probable_dia_n(self, n_dias, estado_inicial_str, P_array=None):
         """
         Retorna (clima_mas_probable, probabilidad) para el día n.
+        Usa P_array si se indica; si no, la matriz del modelo.
         """
         if n_dias < 1:
              return estado_inicial_str, 1.0
 
-        Pn_array = self.calcular_pn(n_dias)
+        Pn_array = self.calcular_pn(n_dias, P_array)
         probabilidades_en_n = self.obtener_probabilidades_finales(Pn_array, estado_inicial_str)
         max_prob = probabilidades_en_n['Probabilidad'].max()
         clima_mas_probable = probabilidades_en_n[np.isclose(probabilidades_en_n['Probabilidad'], max_prob)]['Estado'].iloc[0]
-        return clima_mas_probable, max_prob
\ No newline at end of file
+        return clima_mas_probable, max_prob
+
+    def sensibilidad_pn(self, n, estado_inicial_str, proyectar=True, P_array=None):
+        """
+        Derivada de la distribución a n pasos (fila s de P^n) respecto a cada entrada de P,
+        en un solo recorrido por lotes. Devuelve S con forma (k, k, k):
+        S[i, j, l] = d(P^n)[s, l] / dP[i, j] = sum_m (e_s P^m)[i] · (P^(n-1-m))[j, l].
+        Se guardan las filas e_s P^m (n x k) y se acumula con las potencias P^r
+        calculadas una sola vez: O(n·k^3) operaciones y O(k^3 + n·k) de memoria.
+        Con proyectar=True se respeta que cada fila sume 1: la derivada de la fila i se
+        toma en la dirección de e_j menos la media de la fila (perturbaciones con suma cero).
+        Usa P_array si se indica; si no, la matriz del modelo.
+        """
+        try:
+            estado_idx = self.ESTADOS.index(estado_inicial_str)
+        except ValueError:
+            raise ValueError(f"Estado inicial '{estado_inicial_str}' no es válido.")
+
+        P = np.asarray(self.P_array if P_array is None else P_array, dtype=float)
+        k = P.shape[0]
+        S = np.zeros((k, k, k))
+        if n < 1:
+            return S
+
+        # Filas a_m = e_s P^m para m = 0..n-1
+        filas = np.empty((n, k))
+        filas[0] = np.identity(k)[estado_idx]
+        for m in range(1, n):
+            filas[m] = filas[m - 1] @ P
+
+        # S += a_(n-1-r) ⊗ P^r, avanzando P^r con una multiplicación por paso
+        potencia = np.identity(k)
+        for r in range(n):
+            S += filas[n - 1 - r][:, None, None] * potencia[None, :, :]
+            if r < n - 1:
+                potencia = potencia @ P
+
+        if proyectar:
+            S -= S.mean(axis=1, keepdims=True)
+        return S
+
+    def sensibilidad_clima_mas_probable(self, n_dias, estado_inicial_str, P_array=None):
+        """
+        Retorna (clima_mas_probable, S) donde S[i, j] es la derivada de la probabilidad
+        del clima más probable en el día n respecto a P[i, j] (con suma de filas fija).
+        """
+        clima_mas_probable, _ = self.obtener_clima_mas_probable_dia_n(n_dias, estado_inicial_str, P_array)
+        S = self.sensibilidad_pn(n_dias, estado_inicial_str, P_array=P_array)
+        return clima_mas_probable, S[:, :, self.ESTADOS.index(clima_mas_probable)]
+
+    def _validar_secuencia(self, P_secuencia, etiqueta):
+        """
+        Valida de una sola vez una pila de matrices (T x 3 x 3) con las mismas reglas
+        que validar_matriz. Devuelve el arreglo o lanza ValueError indicando la primera falla.
+        """
+        P_secuencia = np.asarray(P_secuencia, dtype=float)
+        k = len(self.ESTADOS)
+        if P_secuencia.ndim != 3 or P_secuencia.shape[1:] != (k, k):
+            raise ValueError(f"Cada matriz debe ser de {k}x{k}.")
+
+        fuera_de_rango = ((P_secuencia < 0) | (P_secuencia > 1)).any(axis=(1, 2))
+        if fuera_de_rango.any():
+            t = int(np.argmax(fuera_de_rango))
+            raise ValueError(f"{etiqueta} {t}: Todas las probabilidades deben estar en el rango [0, 1].")
+
+        sumas = P_secuencia.sum(axis=2)
+        filas_malas = ~np.isclose(sumas, 1.0, atol=1e-4)
+        if filas_malas.any():
+            t, i = np.argwhere(filas_malas)[0]
+            raise ValueError(f"{etiqueta} {t}: La fila '<b>{self.ESTADOS[i]}</b>' no suma 1.0. Suma: {sumas[t, i]:.4f}")
+        return P_secuencia
+
+    def establecer_calendario(self, P_secuencia, ciclico=False):
+        """
+        Define una matriz de transición por día (cadena no homogénea en el tiempo)
+        y construye su índice de productos. Lanza ValueError si algún día no es válido.
+        """
+        P_secuencia = self._validar_secuencia(P_secuencia, "Día")
+        self.calendario = SeasonalProductIndex(P_secuencia, ciclico=ciclico)
+        return self.calendario
+
+    def establecer_temporadas(self, matrices, duraciones, ciclico=True):
+        """
+        Define el calendario a partir de una matriz por temporada y su duración en días.
+        Cada matriz de temporada se valida una sola vez.
+        """
+        matrices = self._validar_secuencia(matrices, "Temporada")
+        self.calendario = SeasonalProductIndex.desde_temporadas(matrices, duraciones, ciclico=ciclico)
+        return self.calendario
+
+    def calcular_pn_estacional(self, dia_inicial, n):
+        """
+        Calcula P_a · ... · P_{a+n-1} con el calendario (a = dia_inicial).
+        Sin calendario equivale a calcular_pn(n).
+        """
+        if self.calendario is None:
+            return self.calcular_pn(n)
+        if n < 1:
+            return np.identity(len(self.ESTADOS))
+        return self.calendario.producto(dia_inicial, dia_inicial + n)
+
+    def simular_historial_estacional(self, n_dias_simulacion, estado_inicial_str, dia_inicial=0, semilla=None):
+        """
+        Simula n_dias_simulacion siguiendo el calendario: la transición del día t usa su matriz.
+        Sin calendario equivale a simular_historial_climatico con P_array.
+        """
+        if self.calendario is None:
+            return self.simular_historial_climatico(self.P_array, n_dias_simulacion, estado_inicial_str, semilla)
+        if n_dias_simulacion < 1:
+            return []
+
+        generador = random.Random(semilla) if semilla is not None else random
+        try:
+            estado_actual_idx = self.ESTADOS.index(estado_inicial_str)
+        except ValueError:
+            raise ValueError(f"Estado inicial '{estado_inicial_str}' no es válido para simulación.")
+
+        historial = [self.ESTADOS[estado_actual_idx]]
+        # Los días 0..n-1 solo usan las matrices P_0..P_{n-2}
+        for t in range(n_dias_simulacion - 1):
+            transicion_probs = self.calendario.matriz_del_dia(dia_inicial + t)[estado_actual_idx, :]
+            estado_actual_idx = generador.choices(range(len(self.ESTADOS)), weights=transicion_probs, k=1)[0]
+            historial.append(self.ESTADOS[estado_actual_idx])
+
+        return historial
+
+    def _codificar_estados(self, estados):
+        try:
+            return np.array([self.ESTADOS.index(e) for e in estados], dtype=np.int64)
+        except ValueError as e:
+            raise ValueError(f"Historial con estado no válido: {e}")
+
+    def ajustar_orden_superior(self, historial, orden):
+        """
+        Ajusta una cadena de orden 'orden' a un historial (lista de estados o HistoryStore).
+        Un HistoryStore se recorre por bloques sobre su vista mapeada, sin copiarlo a memoria.
+        Los contextos no observados usan P_array como respaldo de primer orden.
+        """
+        if hasattr(historial, 'codigos'):
+            codigos = historial.codigos()
+        else:
+            codigos = self._codificar_estados(historial)
+        self.cadena_orden_superior = HigherOrderChain.ajustar(codigos, orden, len(self.ESTADOS), self.P_array)
+        return self.cadena_orden_superior
+
+    def _contexto_orden_superior(self, ultimos_estados):
+        if self.cadena_orden_superior is None:
+            raise ValueError("Primero debe ajustarse una cadena de orden superior.")
+        return self.cadena_orden_superior.codificar(self._codificar_estados(ultimos_estados))
+
+    def simular_historial_orden_superior(self, n_dias_simulacion, ultimos_estados, semilla=None):
+        """
+        Simula n_dias_simulacion con la cadena de orden k, partiendo de los últimos k estados
+        (del más antiguo al más reciente). Devuelve lista de estados (historial).
+        """
+        if n_dias_simulacion < 1:
+            return []
+        contexto = self._contexto_orden_superior(ultimos_estados)
+        codigos = self.cadena_orden_superior.simular(contexto, n_dias_simulacion, np.random.default_rng(semilla))
+        return [self.ESTADOS[c] for c in codigos]
+
+    def obtener_probabilidades_orden_superior(self, n_dias, ultimos_estados):
+        """
+        Devuelve un DataFrame con las probabilidades de cada estado tras n_dias
+        con la cadena de orden k, dados los últimos k estados.
+        """
+        contexto = self._contexto_orden_superior(ultimos_estados)
+        probabilidades = self.cadena_orden_superior.propagar(contexto, max(n_dias, 0))
+        return pd.DataFrame({
+            'Estado': self.ESTADOS,
+            'Probabilidad': probabilidades
+        })
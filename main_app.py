@@ -1,28 +1,51 @@
 # -*- coding: utf-8 -*-
 import sys
+import hashlib
+from collections import OrderedDict
 import pandas as pd
 from PyQt5.QtWidgets import QApplication, QFileDialog, QTableWidgetItem, QMessageBox
 from PyQt5.QtCore import QTimer
 from logic_model import MarkovModel
 from gui_design import MarkovGUI
 from graph_viewer import GraphViewer
+from columnar_export import ColumnarWriter, exportar_historial, exportar_trayectoria_pn
 
 
 class MarkovController:
 
+    MAX_RESULTADOS_CACHE = 128
+    DEBOUNCE_VISTA_PREVIA_MS = 300
+
     def __init__(self, model, view):
         self.model = model
         self.view = view
         self.graph_viewer = None
+        # Resultados deterministas memoizados: (hash matriz, n, estado inicial) -> P^n y probabilidades
+        self._cache_resultados = OrderedDict()
+        # Historiales memoizados: (hash matriz, n, estado inicial, semilla) -> historial
+        self._cache_historiales = OrderedDict()
+        # Matriz validada de la tabla; se invalida cuando se edita una celda
+        self._P_tabla = None
+        # Parámetros y resultados del último "Calcular" (lo que se exporta)
+        self._ultimo_calculo = None
         self._initialize_matrix_table()
 
+        # Vista previa en vivo: agrupa las ediciones y recalcula solo lo determinista
+        self._timer_vista_previa = QTimer(self.view)
+        self._timer_vista_previa.setSingleShot(True)
+        self._timer_vista_previa.timeout.connect(self._actualizar_vista_previa)
+
         # Conexiones
         self.view.btn_calcular.clicked.connect(self.handle_calculate)
         self.view.btn_reiniciar.clicked.connect(self.handle_reset)
         self.view.btn_importar.clicked.connect(self.handle_import_matrix)
         self.view.btn_guia.clicked.connect(self.view.mostrar_guia)
         self.view.btn_grafico.clicked.connect(self.handle_show_graph)
+        self.view.btn_exportar.clicked.connect(self.handle_export_results)
         self.view.combo_estado_inicial.currentIndexChanged.connect(self.handle_initial_state_changed)
+        self.view.table_matriz.itemChanged.connect(self.handle_matrix_edited)
+        self.view.spin_n_dias.valueChanged.connect(self._programar_vista_previa)
+        self.view.check_vista_previa.toggled.connect(self._programar_vista_previa)
         self.handle_initial_state_changed()
 
     def _initialize_matrix_table(self):
@@ -33,7 +56,7 @@ class MarkovController:
                 item.setTextAlignment(4)
                 self.view.table_matriz.setItem(i, j, item)
 
-    def _get_matrix_from_table(self):
+    def _get_matrix_from_table(self, silencioso=False):
         data = []
         for i in range(3):
             row = []
@@ -42,12 +65,122 @@ class MarkovController:
                 try:
                     value = float(item.text().replace(',', '.')) if item else 0.0
                 except ValueError:
-                    self.view.mostrar_mensaje("Error", f"Valor inválido en la celda {i+1},{j+1}", QMessageBox.Warning)
+                    if not silencioso:
+                        self.view.mostrar_mensaje("Error", f"Valor inválido en la celda {i+1},{j+1}", QMessageBox.Warning)
                     return pd.DataFrame()
                 row.append(value)
             data.append(row)
         return pd.DataFrame(data, columns=self.model.ESTADOS, index=self.model.ESTADOS)
 
+    def _get_validated_matrix(self, silencioso=False):
+        """
+        Devuelve la matriz validada de la tabla, o None si no es válida.
+        Solo vuelve a leer las celdas si la tabla cambió desde la última lectura.
+        """
+        if self._P_tabla is not None:
+            return self._P_tabla
+
+        P_df = self._get_matrix_from_table(silencioso)
+        if P_df.empty:
+            return None
+
+        es_valida, P_array_o_error = self.model.validar_matriz(P_df)
+        if not es_valida:
+            if not silencioso:
+                self.view.mostrar_mensaje("Error de Validación", P_array_o_error, QMessageBox.Critical)
+            return None
+
+        self._P_tabla = P_array_o_error
+        return self._P_tabla
+
+    def _semilla_actual(self):
+        semilla = self.view.spin_semilla.value()
+        return semilla if semilla != self.view.spin_semilla.minimum() else None
+
+    def _guardar_en_cache(self, cache, clave, valor):
+        cache[clave] = valor
+        if len(cache) > self.MAX_RESULTADOS_CACHE:
+            cache.popitem(last=False)
+
+    def _obtener_resultados(self, P_array, n, estado_inicial, semilla, con_historial=True):
+        """
+        Devuelve los resultados de P^n (y opcionalmente el historial simulado).
+        P^n y las probabilidades se memoizan por (hash de la matriz, n, estado inicial);
+        el historial se memoiza además por semilla. Sin semilla el historial es
+        aleatorio, por lo que no se guarda en caché.
+        """
+        clave = (hashlib.sha1(P_array.tobytes()).hexdigest(), n, estado_inicial)
+        resultados = self._cache_resultados.get(clave)
+        if resultados is None:
+            Pn_array = self.model.calcular_pn(n, P_array)
+            clima_mas_probable, prob = self.model.obtener_clima_mas_probable_dia_n(n, estado_inicial, P_array)
+            resultados = {
+                'Pn_array': Pn_array,
+                'df_final': self.model.obtener_probabilidades_finales(Pn_array, estado_inicial),
+                'clima_mas_probable': clima_mas_probable,
+                'prob': prob,
+            }
+            self._guardar_en_cache(self._cache_resultados, clave, resultados)
+        else:
+            self._cache_resultados.move_to_end(clave)
+
+        if not con_historial:
+            return resultados
+
+        clave_historial = clave + (semilla,)
+        historial = self._cache_historiales.get(clave_historial) if semilla is not None else None
+        if historial is None:
+            historial = self.model.simular_historial_climatico(P_array, n, estado_inicial, semilla)
+            if semilla is not None:
+                self._guardar_en_cache(self._cache_historiales, clave_historial, historial)
+        else:
+            self._cache_historiales.move_to_end(clave_historial)
+        return dict(resultados, historial=historial)
+
+    def _mostrar_resultados_deterministas(self, resultados, n):
+        Pn_array = resultados['Pn_array']
+        for i in range(3):
+            for j in range(3):
+                item = QTableWidgetItem(f"{Pn_array[i, j]:.4f}")
+                item.setTextAlignment(4)
+                self.view.table_pn.setItem(i, j, item)
+
+        for _, row in resultados['df_final'].iterrows():
+            estado = row['Estado']
+            prob = row['Probabilidad']
+            self.view.prob_labels[estado].setText(
+                f"Prob. de ser <b>{estado}</b>: {prob * 100:.4f}%"
+            )
+
+        self.view.label_clima_dia_n.setText(
+            f"Clima más probable en el día <b>{n}</b>: <b>{resultados['clima_mas_probable']}</b> ({resultados['prob']*100:.2f}%)"
+        )
+
+    def handle_matrix_edited(self, *_):
+        self._P_tabla = None
+        self._programar_vista_previa()
+
+    def _programar_vista_previa(self, *_):
+        if self.view.check_vista_previa.isChecked():
+            self._timer_vista_previa.start(self.DEBOUNCE_VISTA_PREVIA_MS)
+
+    def _actualizar_vista_previa(self):
+        if not self.view.check_vista_previa.isChecked():
+            return
+        # El historial y la animación pertenecen al último CALCULAR, no a la matriz editada
+        self.view.stats_history_box.setVisible(False)
+        self.view.stop_daily_weather_animation()
+        P_array = self._get_validated_matrix(silencioso=True)
+        if P_array is None:
+            # Los resultados mostrados corresponden a otra matriz: se ocultan
+            self.view.resultados_box.setVisible(False)
+            return
+        n = self.view.spin_n_dias.value()
+        estado_inicial = self.view.combo_estado_inicial.currentText()
+        resultados = self._obtener_resultados(P_array, n, estado_inicial, self._semilla_actual(), con_historial=False)
+        self._mostrar_resultados_deterministas(resultados, n)
+        self.view.resultados_box.setVisible(True)
+
     def handle_initial_state_changed(self):
         estado_inicial = self.view.combo_estado_inicial.currentText()
         if estado_inicial:
@@ -55,45 +188,28 @@ class MarkovController:
         self.view.resultados_box.setVisible(False)
         self.view.stats_history_box.setVisible(False)
         self.view.stop_daily_weather_animation()
+        self._programar_vista_previa()
 
     def handle_calculate(self):
-        P_df = self._get_matrix_from_table()
-        if P_df.empty:
+        P_array = self._get_validated_matrix()
+        if P_array is None:
             return
 
-        es_valida, P_array_o_error = self.model.validar_matriz(P_df)
-        if not es_valida:
-            self.view.mostrar_mensaje("Error de Validación", P_array_o_error, QMessageBox.Critical)
-            return
-
-        self.model.P_array = P_array_o_error
+        self.model.P_array = P_array
         n = self.view.spin_n_dias.value()
         estado_inicial = self.view.combo_estado_inicial.currentText()
 
         try:
-            Pn_array = self.model.calcular_pn(n)
-            df_final = self.model.obtener_probabilidades_finales(Pn_array, estado_inicial)
-
-            for i in range(3):
-                for j in range(3):
-                    item = QTableWidgetItem(f"{Pn_array[i, j]:.4f}")
-                    item.setTextAlignment(4)
-                    self.view.table_pn.setItem(i, j, item)
-
-            for _, row in df_final.iterrows():
-                estado = row['Estado']
-                prob = row['Probabilidad']
-                self.view.prob_labels[estado].setText(
-                    f"Prob. de ser <b>{estado}</b>: {prob * 100:.4f}%"
-                )
-
-            clima_mas_probable, prob = self.model.obtener_clima_mas_probable_dia_n(n, estado_inicial)
-            self.view.label_clima_dia_n.setText(
-                f"Clima más probable en el día <b>{n}</b>: <b>{clima_mas_probable}</b> ({prob*100:.2f}%)"
-            )
+            semilla = self._semilla_actual()
+            resultados = self._obtener_resultados(P_array, n, estado_inicial, semilla)
+            self._mostrar_resultados_deterministas(resultados, n)
 
             # CORRECCIÓN CLAVE: Simular SOLAMENTE 'n' días.
-            historial = self.model.simular_historial_climatico(self.model.P_array, n, estado_inicial)
+            historial = resultados['historial']
+            self._ultimo_calculo = {
+                'P_array': P_array, 'n': n, 'estado_inicial': estado_inicial,
+                'semilla': semilla, 'historial': historial,
+            }
             
             # Las estadísticas se actualizan con el historial correcto de 'n' días.
             self.view.update_statistics_and_history(historial)
@@ -110,6 +226,7 @@ class MarkovController:
 
     def handle_reset(self):
         self.model = MarkovModel()
+        self._ultimo_calculo = None
         self._initialize_matrix_table()
         self.view.resultados_box.setVisible(False)
         self.view.stats_history_box.setVisible(False)
@@ -137,13 +254,34 @@ class MarkovController:
         except Exception as e:
             self.view.mostrar_mensaje("Error", str(e), QMessageBox.Critical)
 
-    def handle_show_graph(self):
-        P_df = self._get_matrix_from_table()
-        if P_df.empty:
+    def handle_export_results(self):
+        calculo = self._ultimo_calculo
+        if calculo is None:
+            self.view.mostrar_mensaje("Sin Resultados", "Presione CALCULAR antes de exportar.", QMessageBox.Warning)
             return
-        es_valida, P_array_o_error = self.model.validar_matriz(P_df)
-        if not es_valida:
-            self.view.mostrar_mensaje("Error", P_array_o_error, QMessageBox.Critical)
+        file, _ = QFileDialog.getSaveFileName(self.view, "Exportar Resultados", "resultados.npz", "NumPy columnar (*.npz)")
+        if not file:
+            return
+
+        # Se exporta exactamente lo calculado, aunque la tabla o los controles hayan cambiado después
+        metadatos = {
+            'estados': self.model.ESTADOS,
+            'n': calculo['n'],
+            'estado_inicial': calculo['estado_inicial'],
+            'semilla': calculo['semilla'],
+            'P': calculo['P_array'].tolist(),
+        }
+        try:
+            with ColumnarWriter(file, metadatos) as writer:
+                exportar_trayectoria_pn(writer, calculo['P_array'], calculo['n'])
+                exportar_historial(writer, calculo['historial'], self.model.ESTADOS)
+            self.view.mostrar_mensaje("Exportación Exitosa", f"Resultados guardados en {file}.")
+        except Exception as e:
+            self.view.mostrar_mensaje("Error", str(e), QMessageBox.Critical)
+
+    def handle_show_graph(self):
+        P_array_o_error = self._get_validated_matrix()
+        if P_array_o_error is None:
             return
             
         # OBTENER EL HISTORIAL SIMULADO DE LA VISTA
@@ -152,8 +290,14 @@ class MarkovController:
         if self.graph_viewer and self.graph_viewer.isVisible():
             self.graph_viewer.close()
             
+        # Sensibilidad del clima más probable en el día n respecto a cada entrada de P
+        estado_objetivo, sensibilidad = self.model.sensibilidad_clima_mas_probable(
+            self.view.spin_n_dias.value(), self.view.combo_estado_inicial.currentText(), P_array_o_error
+        )
+
         # CORRECCIÓN CLAVE: Pasar el historial al GraphViewer
-        self.graph_viewer = GraphViewer(P_array_o_error, self.model.ESTADOS, historial=historial_actual)
+        self.graph_viewer = GraphViewer(P_array_o_error, self.model.ESTADOS, historial=historial_actual,
+                                        sensibilidad=sensibilidad, estado_objetivo=estado_objetivo)
         self.graph_viewer.show()
 
 
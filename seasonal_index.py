@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+
+class SeasonalProductIndex:
+    """
+    Árbol de segmentos sobre una secuencia de matrices de transición P_0, P_1, ..., P_{T-1}
+    (una por día). Cada nodo guarda el producto ordenado de su rango, de modo que
+    P_a · P_{a+1} · ... · P_{b-1} se obtiene con O(log T) multiplicaciones.
+    Con ciclico=True el calendario se repite (p. ej. un año de estaciones).
+    """
+
+    def __init__(self, P_secuencia, ciclico=False):
+        P_secuencia = np.asarray(P_secuencia, dtype=float)
+        if P_secuencia.ndim != 3 or P_secuencia.shape[1] != P_secuencia.shape[2]:
+            raise ValueError("El calendario debe ser una secuencia de matrices cuadradas (T x k x k).")
+        if len(P_secuencia) == 0:
+            raise ValueError("El calendario debe tener al menos un día.")
+
+        self.T = len(P_secuencia)
+        self.k = P_secuencia.shape[1]
+        self.ciclico = ciclico
+
+        self._tamano = 1
+        while self._tamano < self.T:
+            self._tamano *= 2
+        self._arbol = np.tile(np.identity(self.k), (2 * self._tamano, 1, 1))
+        self._arbol[self._tamano:self._tamano + self.T] = P_secuencia
+        # Construcción por niveles: un matmul por lotes por nivel del árbol
+        nivel = self._tamano // 2
+        while nivel >= 1:
+            hijos = self._arbol[2 * nivel:4 * nivel]
+            self._arbol[nivel:2 * nivel] = np.matmul(hijos[0::2], hijos[1::2])
+            nivel //= 2
+        # Las hojas de relleno son identidades, así que la raíz es el producto de todo el calendario
+        self._total = self._arbol[1]
+
+    @classmethod
+    def desde_temporadas(cls, matrices, duraciones, ciclico=True):
+        """
+        Construye el índice a partir de una matriz por temporada y su duración en días.
+        """
+        matrices = np.asarray(matrices, dtype=float)
+        if len(matrices) != len(duraciones):
+            raise ValueError("Debe haber una duración por cada matriz de temporada.")
+        if any(d < 1 for d in duraciones):
+            raise ValueError("Cada temporada debe durar al menos un día.")
+        return cls(np.repeat(matrices, duraciones, axis=0), ciclico=ciclico)
+
+    def __len__(self):
+        return self.T
+
+    def matriz_del_dia(self, dia):
+        if self.ciclico:
+            dia %= self.T
+        elif not 0 <= dia < self.T:
+            raise ValueError(f"El día {dia} está fuera del calendario (0..{self.T - 1}).")
+        return self._arbol[self._tamano + dia]
+
+    def actualizar(self, dia, P):
+        """
+        Reemplaza la matriz del día indicado y recalcula sus ancestros en O(log T).
+        """
+        if not 0 <= dia < self.T:
+            raise ValueError(f"El día {dia} está fuera del calendario (0..{self.T - 1}).")
+        i = self._tamano + dia
+        self._arbol[i] = P
+        i //= 2
+        while i >= 1:
+            self._arbol[i] = self._arbol[2 * i] @ self._arbol[2 * i + 1]
+            i //= 2
+        self._total = self._arbol[1]
+
+    def _nodos_rango(self, a, b):
+        """
+        Nodos que cubren [a, b) en orden de izquierda a derecha.
+        """
+        izquierda, derecha = [], []
+        a += self._tamano
+        b += self._tamano
+        while a < b:
+            if a & 1:
+                izquierda.append(a)
+                a += 1
+            if b & 1:
+                b -= 1
+                derecha.append(b)
+            a //= 2
+            b //= 2
+        return izquierda + derecha[::-1]
+
+    def _producto_lineal(self, a, b):
+        resultado = np.identity(self.k)
+        for nodo in self._nodos_rango(a, b):
+            resultado = resultado @ self._arbol[nodo]
+        return resultado
+
+    def producto(self, a, b):
+        """
+        Devuelve P_a · ... · P_{b-1}: la fila i es la distribución del día b
+        partiendo del estado i en el día a. Si a == b devuelve la identidad.
+        """
+        if a > b or a < 0:
+            raise ValueError(f"Rango de días inválido: [{a}, {b}).")
+        if not self.ciclico:
+            if b > self.T:
+                raise ValueError(f"El día {b} está fuera del calendario (0..{self.T}).")
+            return self._producto_lineal(a, b)
+
+        inicio = a % self.T
+        longitud = b - a
+        if inicio + longitud <= self.T:
+            return self._producto_lineal(inicio, inicio + longitud)
+        # Resto del ciclo actual, ciclos completos (potencia rápida) y parte del último ciclo
+        resultado = self._producto_lineal(inicio, self.T)
+        ciclos, resto = divmod(longitud - (self.T - inicio), self.T)
+        if ciclos:
+            resultado = resultado @ np.linalg.matrix_power(self._total, ciclos)
+        return resultado @ self._producto_lineal(0, resto)
+
+    def distribucion(self, a, b, distribucion_inicial):
+        """
+        Propaga un vector de probabilidades del día a al día b.
+        """
+        if a > b or a < 0:
+            raise ValueError(f"Rango de días inválido: [{a}, {b}).")
+        v = np.asarray(distribucion_inicial, dtype=float)
+        if self.ciclico:
+            inicio, fin = a % self.T, a % self.T + (b - a)
+            if fin > self.T:
+                return v @ self.producto(a, b)
+        else:
+            if b > self.T:
+                raise ValueError(f"El día {b} está fuera del calendario (0..{self.T}).")
+            inicio, fin = a, b
+        # Producto vector-matriz nodo a nodo: O(k^2 log T) en vez de O(k^3 log T)
+        for nodo in self._nodos_rango(inicio, fin):
+            v = v @ self._arbol[nodo]
+        return v